@@ -14,13 +14,32 @@ import sys
 import traceback
 import json
 import shutil
+import socket
+import subprocess
+import urllib.error
 import urllib.request
+import zipfile
+from functools import cached_property
 from pathlib import Path
-from typing import List, Dict
+from typing import List, Dict, Set
 
 sys.path.append(str(Path(__file__).absolute().parent.parent) + "/")
 import system
-from util import Color, Command, inp, inp_or_default, bash, run_steps, fwrite, eprint, Step, errw, ExecOpts, catch_errs
+from util import (
+    Color,
+    Command,
+    inp,
+    inp_or_default,
+    bash,
+    run_steps,
+    fwrite,
+    atomic_open,
+    eprint,
+    Step,
+    errw,
+    ExecOpts,
+    catch_errs,
+)
 
 ################################################################################
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ config ~~~~~~~~~~~~|
@@ -28,8 +47,10 @@ from util import Color, Command, inp, inp_or_default, bash, run_steps, fwrite, e
 
 REPO_BASE = "https://github.com/wojciechkepka"
 GIT_CONF_REPO = f"{REPO_BASE}/configs"
+GIT_CONF_RAW = f"{GIT_CONF_REPO}/raw/master"
 GIT_SCRIPTS_REPO = f"{REPO_BASE}/scripts"
 PKG_URL = "https://wkepka.dev/static/pkgs"
+VIM_PLUG_URL = "https://raw.githubusercontent.com/junegunn/vim-plug/master/plug.vim"
 
 LOCALES = ["en_US.UTF-8", "en_GB.UTF-8", "pl_PL.UTF-8"]
 LANG = "en_US.UTF-8"
@@ -43,23 +64,137 @@ CITY = "Warsaw"
 
 FULLPATH = Path(__file__)
 FILENAME = FULLPATH.name
+ROOT = Path("/")
+
+CACHE_DIR = Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "genesis"
+PKGS_CACHE = CACHE_DIR / "pkgs.json"
+PKGS_CACHE_META = CACHE_DIR / "pkgs.meta.json"
+VIM_PLUG_ETAG = CACHE_DIR / "plug.vim.etag"
+
+# seconds to wait for a server before falling back to cached data
+URL_TIMEOUT = 10
+
+_STATIC_CONF_DIRS = (
+    Path("/etc/lightdm"),
+    Path("/etc/default"),
+    Path("/usr/share/backgrounds"),
+    Path("/usr/share/themes"),
+    Path("/usr/share/vim/vimfiles/ftdetect"),
+    Path("/usr/share/vim/vimfiles/syntax"),
+    Path("/usr/share/grub/themes"),
+)
+
+_XDG_SUBDIRS = (
+    "alacritty",
+    "bspwm",
+    "nvim",
+    "polybar",
+    "sxhkd",
+    "termite",
+    "gtk-3.0",
+    "dunst",
+    "rofi",
+    "picom",
+    "zathura",
+)
+
+_CONF_FILES = (
+    ".bashrc",
+    ".gtkrc-2.0",
+    ".gitconfig",
+    ".newsboat",
+    ".tmux.conf",
+    ".xinitrc",
+    ".Xresources",
+    ".config/alacritty/alacritty.yml",
+    ".config/bspwm/bspwmrc",
+    ".config/nvim/init.vim",
+    ".config/nvim/coc-settings.json",
+    ".config/polybar/colors.ini",
+    ".config/polybar/config.ini",
+    ".config/polybar/modules.ini",
+    ".config/sxhkd/sxhkdrc",
+    ".config/termite/config",
+    ".config/dunst/dunstrc",
+    ".config/gtk-3.0/settings.ini",
+    ".config/gtk-3.0/gtk.css",
+    ".config/picom/picom.conf",
+    ".config/rofi/config.rasi",
+    ".config/zathura/zathurarc",
+)
+
+_GLOBAL_FILES = (
+    "/etc/default/grub",
+    "/etc/lightdm/lightdm.conf",
+    "/etc/lightdm/lightdm-gtk-greeter.conf",
+    "/etc/mkinitcpio.conf",
+    "/usr/share/vim/vimfiles/syntax/notes.vim",
+    "/usr/share/vim/vimfiles/ftdetect/notes.vim",
+    "/usr/share/grub/themes/mytheme",
+    "/etc/pacman.conf",
+)
 
 ################################################################################
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ packages ~~~~~~~~~~|
 ################################################################################
 
-try:
-    PKGS = json.loads(urllib.request.urlopen(PKG_URL).read())
-except Exception as e:
+DEFAULT_PKGS: Dict[str, List[str]] = {
+    "base": ["base", "base-devel", "linux", "linux-firmware", "lvm2", "mdadm", "dhcpcd"],
+    "community": [],
+    "aur": [],
+    "coc": [],
+}
+
+
+def _cache_pkgs(body: bytes, headers: Dict[str, str]):
+    try:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        for (p, data) in ((PKGS_CACHE, body), (PKGS_CACHE_META, json.dumps(headers).encode())):
+            tmp = p.with_suffix(p.suffix + ".tmp")
+            tmp.write_bytes(data)
+            os.replace(tmp, p)
+    except OSError as e:
+        errw(
+            f"{Color.BWHITE}Failed to cache pkgs data in{Color.NC} `{Color.LBLUE}{CACHE_DIR}{Color.NC}` - {Color.RED}{e}{Color.NC}\n"
+        )
+
+
+def load_pkgs() -> Dict[str, List[str]]:
+    """Returns package lists fetched from PKG_URL. The response is cached on disk together with its
+    ETag/Last-Modified headers so that subsequent runs only issue a conditional GET. If the server
+    can't be reached the cached copy is used, and if there is none DEFAULT_PKGS are returned."""
+    cached = None
+    headers = {}
+    try:
+        cached = json.loads(PKGS_CACHE.read_bytes())
+        meta = json.loads(PKGS_CACHE_META.read_bytes())
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+    except (OSError, ValueError):
+        pass
+
+    try:
+        with urllib.request.urlopen(urllib.request.Request(PKG_URL, headers=headers), timeout=URL_TIMEOUT) as resp:
+            body = resp.read()
+            pkgs = json.loads(body)
+            _cache_pkgs(body, {"etag": resp.headers.get("ETag"), "last_modified": resp.headers.get("Last-Modified")})
+            return pkgs
+    except urllib.error.HTTPError as e:
+        if e.code == 304 and cached is not None:
+            return cached
+        err = str(e)
+    except Exception as e:
+        err = str(e)
+
     errw(
-        f"{Color.BWHITE}Failed to get pkgs data from{Color.NC} `{Color.LBLUE}{PKG_URL}{Color.NC}` - {Color.RED}{e}{Color.NC}\n"
+        f"{Color.BWHITE}Failed to get pkgs data from{Color.NC} `{Color.LBLUE}{PKG_URL}{Color.NC}` - {Color.RED}{err}{Color.NC}\n"
     )
-    PGKS: Dict[str, List[str]] = {
-        "base": ["base", "base-devel", "linux", "linux-firmware", "lvm2", "mdadm", "dhcpcd"],
-        "community": [],
-        "aur": [],
-        "coc": [],
-    }
+    return cached if cached is not None else DEFAULT_PKGS
+
+
+PKGS = load_pkgs()
 
 
 ################################################################################
@@ -88,20 +223,20 @@ class SetupConfig(object):
         else:
             return SetupConfig()
 
-    def as_args_str(self, location=True, user=True, password=True, hostname=True, auto=True) -> str:
-        s = " "
+    def as_args(self, location=True, user=True, password=True, hostname=True, auto=True) -> List[str]:
+        args = []
         if location:
-            s += f"--location {self.location} "
+            args += ["--location", self.location]
         if user:
-            s += f"--user {self.user} "
+            args += ["--user", self.user]
         if password:
-            s += f"--password {self.password} "
+            args += ["--password", self.password]
         if hostname:
-            s += f"--hostname {self.hostname} "
+            args += ["--hostname", self.hostname]
         if auto:
-            s += "--auto "
+            args.append("--auto")
 
-        return s
+        return args
 
 
 class Init(object):
@@ -110,31 +245,38 @@ class Init(object):
         self.cfg = cfg
 
     def gen_fstab(self):
-        bash(
-            f"/usr/bin/genfstab -U {self.location} >> {self.location}/etc/fstab",
-            quit=True,
-        )
+        fstab = Path(self.location) / "etc" / "fstab"
+        print(f"{Color.BWHITE}Appending{Color.NC} `genfstab -U {self.location}` to {Color.LBLUE}`{fstab}`{Color.NC}")
+        with open(fstab, "ab") as f:
+            ret = subprocess.run(["/usr/bin/genfstab", "-U", self.location], stdout=f).returncode
+        if ret != 0:
+            sys.exit(ret)
 
     def pacstrap(self, pkgs: List[str]):
-        Command("/usr/bin/pacstrap", [self.location] + pkgs, opts=ExecOpts(quit=quit)).safe_run(reraise=False)
+        Command("/usr/bin/pacstrap", [self.location] + pkgs, opts=ExecOpts(quit=True)).safe_run(reraise=False)
 
-    def arch_chroot(self, cmd: str):
+    def arch_chroot(self, argv: List[str]):
         Command(
             "/usr/bin/arch-chroot",
-            [self.location, "/bin/bash", "-c", cmd],
+            [self.location, *argv],
             opts=ExecOpts(quit=True, redirect=True, follow=False),
         ).safe_run(reraise=False)
 
     def archive_scripts(self):
-        bash(f"cd {FULLPATH.parent} && cp ../*.py . && zip -r {self.location}/{FILENAME} ./*.py", quit=True)
+        """Packs setup scripts together with shared modules into a zip archive runnable by python."""
+        archive = Path(self.location) / FILENAME
+        print(f"{Color.BWHITE}Archiving scripts{Color.NC} to {Color.LBLUE}`{archive}`{Color.NC}")
+        with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as zf:
+            for p in [*FULLPATH.parent.glob("*.py"), *FULLPATH.absolute().parent.parent.glob("*.py")]:
+                zf.write(p, arcname=p.name)
 
     def init_setup(self):
         self.archive_scripts()
-        cmd = f"/usr/bin/python {FILENAME} setup"
+        argv = ["/usr/bin/python", FILENAME, "setup"]
         if self.cfg.auto:
-            cmd += self.cfg.as_args_str(location=False)
+            argv += self.cfg.as_args(location=False)
 
-        self.arch_chroot(cmd)
+        self.arch_chroot(argv)
 
     def init(self):
         run_steps(
@@ -154,27 +296,61 @@ class Setup(object):
         self.password = cfg.password
         self.hostname = cfg.hostname
         self.ask = not cfg.auto
+        # directories to recursively chown to the user once setup finishes
+        self._pending_chowns: Set[Path] = set()
 
+    @cached_property
     def git_conf_dir(self) -> Path:
         return Path("/etc/configs")
 
+    @cached_property
     def xdg_conf_dir(self) -> Path:
         return self.userhome / ".config"
 
+    @cached_property
     def theme_dir(self) -> Path:
         return self.userhome / ".themes"
 
+    @cached_property
     def icons_dir(self) -> Path:
         return self.userhome / ".icons"
 
+    def _set_username(self, username: str):
+        self.username = username
+        self.userhome = Path(f"/home/{username}")
+        # home derived directories are cached so they have to be dropped once the home changes
+        for attr in ("xdg_conf_dir", "theme_dir", "icons_dir"):
+            self.__dict__.pop(attr, None)
+
     def create_user(self):
         if not self.username:
-            self.username = inp("Enter username: ")
-            self.userhome = Path(f"/home/{self.username}")
+            self._set_username(inp("Enter username: "))
 
         system.create_user(self.username, password=self.password)
         system.sudo_nopasswd(self.username)
 
+    def _chown_later(self, p: Path):
+        self._pending_chowns.add(p)
+
+    def flush_chowns(self):
+        """Recursively chowns all pending directories to the user skipping the ones already
+        contained in another pending directory, so that each tree is walked only once."""
+        roots: List[Path] = []
+        for p in sorted(self._pending_chowns, key=lambda p: len(p.parts)):
+            if not any(root == p or root in p.parents for root in roots):
+                roots.append(p)
+
+        if self.username:
+            for root in roots:
+                # one failing tree must not keep the rest from being chowned
+                try:
+                    system.chown(root, self.username, self.username)
+                except Exception as e:
+                    errw(
+                        f"{Color.BWHITE}Failed changing owner of{Color.NC} `{Color.LBLUE}{root}{Color.NC}` - {Color.RED}{e}{Color.NC}\n"
+                    )
+        self._pending_chowns.clear()
+
     def create_home_dirs(self):
         dirs = [
             self.userhome / "screenshots",
@@ -182,8 +358,8 @@ class Setup(object):
             self.userhome / "Downloads",
             self.userhome / "Documents",
             self.userhome / "dev",
-            self.theme_dir(),
-            self.icons_dir(),
+            self.theme_dir,
+            self.icons_dir,
         ]
 
         for d in dirs:
@@ -196,138 +372,96 @@ class Setup(object):
         if not self.username:
             self.username = inp("Enter username: ")
 
+        # tools needed by later steps are installed together in their own transaction so that a tool
+        # that can't be resolved doesn't keep the package list from being installed
+        system.queue_pkg_if_bin_not_exists("nvim", pkg="neovim")
+        system.queue_pkg_if_bin_not_exists("pip", pkg="python-pip")
+        system.queue_pkg_if_bin_not_exists("pip2", pkg="python2-pip")
+        system.flush_pending_pkgs()
+
         system.install_pkgs(pkgs, pkgmngr="paru", user=self.username)
 
-    def install_themes(self):
-        if Path(self.theme_dir()).exists():
-            shutil.rmtree(self.theme_dir())
+    def _theme_archive_job(self, name: str) -> tuple:
+        """Returns a job extracting theme archive from the local configs repo if it was already
+        cloned, otherwise the archive is streamed directly from the remote repo."""
+        archive = self.git_conf_dir / "themes" / name
+        if archive.exists():
+            return (system.extar, archive, self.theme_dir)
+
+        return (system.download_and_extract, f"{GIT_CONF_RAW}/themes/{name}", self.theme_dir)
 
-        os.makedirs(self.theme_dir())
+    def install_themes(self):
+        if Path(self.theme_dir).exists():
+            shutil.rmtree(self.theme_dir)
 
-        git_theme_dir = self.git_conf_dir() / "themes"
-        system.extar(git_theme_dir / "Sweet-Dark.tar.xz", self.theme_dir())
-        system.extar(git_theme_dir / "Sweet-Purple.tar.xz", self.theme_dir())
-        system.extar(git_theme_dir / "Sweet-Teal.tar.xz", self.theme_dir())
+        os.makedirs(self.theme_dir)
+        self._chown_later(self.theme_dir)
 
-        Command(
-            "unzip",
+        git_theme_dir = self.git_conf_dir / "themes"
+        # git and curl have to be installed upfront so that concurrent clones and downloads don't race
+        # for the pacman lock
+        system.ensure_pkgs(["git", "curl"])
+        system.run_parallel(
             [
-                str(git_theme_dir / "Solarized-Dark-Orange_2.0.1.zip"),
-                "-d",
-                str(self.theme_dir()),
-            ],
-        ).safe_run()
-        system.gitclone(f"{REPO_BASE}/gruvbox-gtk", self.theme_dir() / "gruvbox-gtk")
-        system.gitclone(f"{REPO_BASE}/Aritim-Dark", self.theme_dir() / "aritim")
-        system.gitclone("https://github.com/Dracula/gtk", self.theme_dir() / "Dracula")
+                self._theme_archive_job("Sweet-Dark.tar.xz"),
+                self._theme_archive_job("Sweet-Purple.tar.xz"),
+                self._theme_archive_job("Sweet-Teal.tar.xz"),
+                (
+                    Command(
+                        "unzip", [str(git_theme_dir / "Solarized-Dark-Orange_2.0.1.zip"), "-d", str(self.theme_dir)]
+                    ).safe_run,
+                ),
+                (system.gitclone, f"{REPO_BASE}/gruvbox-gtk", self.theme_dir / "gruvbox-gtk"),
+                (system.gitclone, f"{REPO_BASE}/Aritim-Dark", self.theme_dir / "aritim"),
+                (system.gitclone, "https://github.com/Dracula/gtk", self.theme_dir / "Dracula"),
+            ]
+        )
 
         try:
-            Command("mv", [str(self.theme_dir() / "aritim/GTK"), str(self.theme_dir() / "Aritim-Dark")]).safe_run()
+            Command("mv", [str(self.theme_dir / "aritim/GTK"), str(self.theme_dir / "Aritim-Dark")]).safe_run()
         finally:
-            shutil.rmtree(str(self.theme_dir() / "aritim"))
+            shutil.rmtree(str(self.theme_dir / "aritim"))
 
-        system.cp(self.theme_dir() / "Dracula", Path("/usr/share/themes/Dracula"))
-        system.cp(self.theme_dir() / "gruvbox-gtk", Path("/usr/share/themes/gruvbox-gtk"))
-        system.cp(self.theme_dir() / "Aritim-Dark", Path("/usr/share/themes/Aritim-Dark"))
+        system.cp(self.theme_dir / "Dracula", Path("/usr/share/themes/Dracula"))
+        system.cp(self.theme_dir / "gruvbox-gtk", Path("/usr/share/themes/gruvbox-gtk"))
+        system.cp(self.theme_dir / "Aritim-Dark", Path("/usr/share/themes/Aritim-Dark"))
 
     def install_configs(self):
         conf_dirs = [
-            self.git_conf_dir(),
-            self.xdg_conf_dir(),
-            Path("/etc/lightdm"),
-            Path("/etc/default"),
-            Path("/usr/share/backgrounds"),
-            Path("/usr/share/themes"),
-            Path("/usr/share/vim/vimfiles/ftdetect"),
-            Path("/usr/share/vim/vimfiles/syntax"),
-            Path("/usr/share/grub/themes"),
-            self.xdg_conf_dir() / "alacritty",
-            self.xdg_conf_dir() / "bspwm",
-            self.xdg_conf_dir() / "nvim",
-            self.xdg_conf_dir() / "polybar",
-            self.xdg_conf_dir() / "sxhkd",
-            self.xdg_conf_dir() / "termite",
-            self.xdg_conf_dir() / "gtk-3.0",
-            self.xdg_conf_dir() / "dunst",
-            self.xdg_conf_dir() / "rofi",
-            self.xdg_conf_dir() / "picom",
-            self.xdg_conf_dir() / "zathura",
+            self.git_conf_dir,
+            self.xdg_conf_dir,
             self.userhome / "newsboat",
+            *_STATIC_CONF_DIRS,
+            *[self.xdg_conf_dir / sub for sub in _XDG_SUBDIRS],
         ]
+        system.mkdirs(conf_dirs)
 
-        for d in conf_dirs:
-            d.mkdir(parents=True, exist_ok=True)
+        system.gitclone(GIT_CONF_REPO, self.git_conf_dir)
+        system._link(self.git_conf_dir, self.userhome / "dev" / "conf")
 
-        system.gitclone(GIT_CONF_REPO, self.git_conf_dir())
-        system._link(self.git_conf_dir(), self.userhome / "dev" / "conf")
-
-        conf_files = [
-            ".bashrc",
-            ".gtkrc-2.0",
-            ".gitconfig",
-            ".newsboat",
-            ".tmux.conf",
-            ".xinitrc",
-            ".Xresources",
-            ".config/alacritty/alacritty.yml",
-            ".config/bspwm/bspwmrc",
-            ".config/nvim/init.vim",
-            ".config/nvim/coc-settings.json",
-            ".config/polybar/colors.ini",
-            ".config/polybar/config.ini",
-            ".config/polybar/modules.ini",
-            ".config/sxhkd/sxhkdrc",
-            ".config/termite/config",
-            ".config/dunst/dunstrc",
-            ".config/gtk-3.0/settings.ini",
-            ".config/gtk-3.0/gtk.css",
-            ".config/picom/picom.conf",
-            ".config/rofi/config.rasi",
-            ".config/zathura/zathurarc",
-        ]
-
-        for f in conf_files:
-            system.link(self.git_conf_dir(), f, self.userhome)
-
-        global_files = [
-            "/etc/default/grub",
-            "/etc/lightdm/lightdm.conf",
-            "/etc/lightdm/lightdm-gtk-greeter.conf",
-            "/etc/mkinitcpio.conf",
-            "/usr/share/vim/vimfiles/syntax/notes.vim",
-            "/usr/share/vim/vimfiles/ftdetect/notes.vim",
-            "/usr/share/grub/themes/mytheme",
-            "/etc/pacman.conf",
-        ]
+        for f in _CONF_FILES:
+            system.link(self.git_conf_dir, f, self.userhome)
 
-        for f in global_files:
-            system.link(self.git_conf_dir(), f, Path("/"))
+        for f in _GLOBAL_FILES:
+            system.link(self.git_conf_dir, f, ROOT)
 
-        system.chmod("+x", self.git_conf_dir() / ".config/bspwm/bspwmrc")
+        system.chmod("+x", self.git_conf_dir / ".config/bspwm/bspwmrc")
 
         fwrite(Path("/etc/profile"), "export XDG_CONFIG_DIR=$HOME/.config")
 
-        system.chown(self.git_conf_dir(), self.username, self.username)
-        system.chown(self.userhome, self.username, self.username)
+        self._chown_later(self.git_conf_dir)
+        self._chown_later(self.userhome)
 
     def install_scripts(self):
         scripts_dir = Path("/usr/local/scripts")
         system.gitclone(GIT_SCRIPTS_REPO, scripts_dir)
-        system.chown(scripts_dir, self.username, self.username)
+        self._chown_later(scripts_dir)
         system._link(scripts_dir, self.userhome / "dev" / "scripts")
 
         p = Path("/etc/profile.d/scripts_path.sh")
         if not p.exists():
             fwrite(p, f"export PATH=$PATH:{str(scripts_dir)}")
 
-    def set_lang(self):
-        lang = inp_or_default("Enter system language", LANG) if self.ask else LANG
-        system.set_lang(lang)
-
-    def set_keymap(self):
-        keymap = inp_or_default("Enter keymap", KEYMAP) if self.ask else KEYMAP
-        system.set_keymap(keymap)
-
     def set_timezone(self):
         region = inp_or_default("Enter region", REGION) if self.ask else REGION
         city = inp_or_default("Enter city", CITY) if self.ask else CITY
@@ -336,25 +470,48 @@ class Setup(object):
     def datetime_location_setup(self):
         s = system
         s.gen_locale(LOCALES)
-        self.set_lang()
-        self.set_keymap()
+        lang = inp_or_default("Enter system language", LANG) if self.ask else LANG
+        keymap = inp_or_default("Enter keymap", KEYMAP) if self.ask else KEYMAP
         self.set_timezone()
         if not self.hostname and self.ask:
             self.hostname = inp("Enter hostname: ")
-        s.set_hostname(self.hostname)
-        s.create_hosts()
+        s.write_host_config(lang, keymap, self.hostname)
 
     def install_vim_plug(self):
-        f = self.xdg_conf_dir().joinpath("nvim/autoload/plug.vim")
-        url = "https://raw.githubusercontent.com/junegunn/vim-plug/master/plug.vim"
-        if not f.exists():
-            bash(f"curl -fLo {f} --create-dirs {url}")
-            system.chown(self.xdg_conf_dir(), self.username, self.username)
+        f = self.xdg_conf_dir.joinpath("nvim/autoload/plug.vim")
+        exists = f.exists()
+        if exists and not VIM_PLUG_ETAG.exists():
+            # existing copy that can't be revalidated is kept as is
+            return
+
+        headers = {"If-None-Match": VIM_PLUG_ETAG.read_text()} if exists else {}
+
+        try:
+            request = urllib.request.Request(VIM_PLUG_URL, headers=headers)
+            with urllib.request.urlopen(request, timeout=URL_TIMEOUT) as resp:
+                data = resp.read()
+                etag = resp.headers.get("ETag")
+
+            f.parent.mkdir(parents=True, exist_ok=True)
+            with atomic_open(f, "wb") as out:
+                out.write(data)
+            if etag:
+                CACHE_DIR.mkdir(parents=True, exist_ok=True)
+                VIM_PLUG_ETAG.write_text(etag)
+        except urllib.error.HTTPError as e:
+            # 304 - local copy is up to date
+            if e.code != 304:
+                raise
+        except (urllib.error.URLError, socket.timeout):
+            if not exists:
+                bash(f"curl -fLo {f} --create-dirs {VIM_PLUG_URL}")
+
+        self._chown_later(self.xdg_conf_dir)
 
     def install_nvim_plugins(self):
         system.install_pkg_if_bin_not_exists("nvim", pkg="neovim")
         self.install_vim_plug()
-        p = self.xdg_conf_dir().joinpath("/nvim/init.vim")
+        p = self.xdg_conf_dir.joinpath("/nvim/init.vim")
         if Path(p).exists():
             system.nvim("PlugInstall|q|q")
         else:
@@ -382,11 +539,15 @@ class Setup(object):
         Command("mkinitcpio", ["-P"]).safe_run()
 
     def enable_services(self):
-        services = ["sshd", "lightdm", "dhcpcd"]
-        for service in services:
-            system.systemctl_enable(service)
+        system.systemctl_enable("sshd", "lightdm", "dhcpcd")
 
     def setup(self):
+        try:
+            self._setup_steps()
+        finally:
+            self.flush_chowns()
+
+    def _setup_steps(self):
         run_steps(
             [
                 Step("Create user?", self.create_user),
@@ -8,13 +8,20 @@ Functions providing easier api to interacting with linux
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ imports ~~~~~~~~~~~|
 ################################################################################
 
+import functools
 import shutil
+import shlex
 import os
+import re
+import stat
+import pwd
+import grp
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from tempfile import TemporaryDirectory
-from typing import List
+from typing import List, Set, Iterable, Tuple, Callable, Any, FrozenSet, Optional, Dict
 from pathlib import Path
-from util import Command, fwrite, bash, ExecOpts
+from util import Command, Color, fwrite, fwrite_many, atomic_open, force_symlink, bash, errw, ExecOpts
 
 ################################################################################
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ globals ~~~~~~~~~~~|
@@ -24,40 +31,232 @@ ARCH_URL = "https://aur.archlinux.org"
 PACKAGE_QUERY_REPO = f"{ARCH_URL}/package-query.git"
 PARU_REPO = "https://aur.archlinux.org/paru.git"
 
+LOCALE_GEN = Path("/etc/locale.gen")
+LOCALE_CONF = Path("/etc/locale.conf")
+VCONSOLE_CONF = Path("/etc/vconsole.conf")
+HOSTNAME = Path("/etc/hostname")
+HOSTS = Path("/etc/hosts")
+HOSTS_CONTENT = "127.0.0.1     localhost\n::1           localhost\n"
+
+# options for commands that don't need their output captured
+SPAWN_OPTS = ExecOpts(redirect=True, follow=False)
+
+# symbolic chmod mode clause like `u+x` or `go-w`
+SYMBOLIC_MODE_RE = re.compile(r"([ugoa]*)([-+=])([rwx]*)")
+PERMISSION_BITS = {
+    "u": (stat.S_IRUSR, stat.S_IWUSR, stat.S_IXUSR),
+    "g": (stat.S_IRGRP, stat.S_IWGRP, stat.S_IXGRP),
+    "o": (stat.S_IROTH, stat.S_IWOTH, stat.S_IXOTH),
+}
+# special bits cleared by `=` for each who, directories keep their set-user-ID and set-group-ID bits
+SPECIAL_BITS = {"u": stat.S_ISUID, "g": stat.S_ISGID, "o": stat.S_ISVTX}
+DIR_KEPT_BITS = stat.S_ISUID | stat.S_ISGID
+
+# max number of threads used by run_parallel
+MAX_WORKERS = 8
+
+# names of installed packages, lazily queried by installed_pkgs
+_INSTALLED_PKGS: Optional[FrozenSet[str]] = None
+
+################################################################################
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ classes ~~~~~~~~~~~|
+################################################################################
+
+
+class PkgQueue(object):
+    """PkgQueue collects packages requested in different places so that they are installed
+    together in a single package manager transaction."""
+
+    def __init__(self):
+        self.pkgs: Set[str] = set()
+
+    def add(self, *pkgs: str):
+        self.pkgs.update(pkgs)
+
+    def flush(self, pkgs: Iterable[str] = (), pkgmngr="/usr/bin/pacman", user="root"):
+        """Installs all queued packages together with pkgs in a single package manager invocation."""
+        pkgs = list(pkgs)
+        to_install = pkgs + sorted(self.pkgs.difference(pkgs))
+        if to_install:
+            install_pkgs(to_install, pkgmngr=pkgmngr, user=user)
+        self.pkgs.clear()
+
+
+# packages queued to be installed together in a single transaction
+pkg_queue = PkgQueue()
+
+
 ################################################################################
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ funcs ~~~~~~~~~~~~~|
 ################################################################################
 
 
+def mkdirs(dirs: Iterable[Path], mode=0o755):
+    """Creates all dirs that don't exist yet. Dirs are deduplicated and created from the shallowest
+    so that most of them take a single mkdir syscall, missing ancestors are created as needed."""
+    for d in sorted(set(dirs), key=lambda p: len(p.parts)):
+        try:
+            os.mkdir(d, mode)
+        except FileExistsError:
+            pass
+        except FileNotFoundError:
+            d.mkdir(mode, parents=True, exist_ok=True)
+
+
+def _umask() -> int:
+    mask = os.umask(0)
+    os.umask(mask)
+    return mask
+
+
+def _apply_mode(flags: str, mode: int) -> Optional[int]:
+    """Applies chmod flags to mode. Flags can be an octal mode or comma separated symbolic modes
+    like `u+x,go-w`, when who is omitted umask is respected like chmod does. Returns None if flags
+    are not supported."""
+    kept = stat.S_IMODE(mode) & DIR_KEPT_BITS if stat.S_ISDIR(mode) else 0
+    if re.fullmatch(r"[0-7]{1,4}", flags):
+        return int(flags, 8) | kept
+
+    mode = stat.S_IMODE(mode)
+    for clause in flags.split(","):
+        m = SYMBOLIC_MODE_RE.fullmatch(clause)
+        if m is None:
+            return None
+
+        (who, op, perms) = m.groups()
+        targets = who.replace("a", "ugo") or "ugo"
+        (bits, every, special) = (0, 0, 0)
+        for w in targets:
+            special |= SPECIAL_BITS[w]
+            for (perm, bit) in zip("rwx", PERMISSION_BITS[w]):
+                every |= bit
+                if perm in perms:
+                    bits |= bit
+        if not who:
+            bits &= ~_umask()
+
+        if op == "+":
+            mode |= bits
+        elif op == "-":
+            mode &= ~bits
+        else:
+            mode = (mode & ~(every | (special & ~kept))) | bits
+
+    return mode
+
+
+def _failed(action: str, p: Path, e: Exception):
+    """Reports a failed filesystem operation on p without aborting the caller, like a failed
+    command run with safe_run."""
+    errw(f"{Color.BWHITE}Failed {action}{Color.NC} `{Color.LBLUE}{p}{Color.NC}` - {Color.RED}{e}{Color.NC}\n")
+
+
 def chmod(flags: str, f: Path):
-    Command("chmod", [flags, "--verbose", str(f)]).safe_run()
+    try:
+        mode = _apply_mode(flags, os.stat(f).st_mode)
+        if mode is None:
+            Command("chmod", [flags, "--verbose", str(f)], opts=SPAWN_OPTS).safe_run()
+            return
 
+        print(f"{Color.BWHITE}Changing mode{Color.NC} of {Color.LBLUE}`{f}`{Color.NC} to {oct(mode)}")
+        os.chmod(f, mode)
+    except OSError as e:
+        _failed("changing mode of", f, e)
 
-def chown(p: Path, user: str, group: str, recursive=True):
-    Command(
-        "chown",
-        ["-R", f"{user}:{group}", str(p)] if recursive else [f"{user}:{group}", str(p)],
-    ).safe_run()
 
+@functools.lru_cache(maxsize=64)
+def _uid(user: str) -> int:
+    return pwd.getpwnam(user).pw_uid
 
-def cp(f1: Path, f2: Path):
-    Command("cp", ["--verbose", str(f1), str(f2)]).safe_run()
+
+@functools.lru_cache(maxsize=64)
+def _gid(group: str) -> int:
+    return grp.getgrnam(group).gr_gid
 
 
-def gitclone(repo: str, where=Path("")):
+def chown(p: Path, user: str, group: str, recursive=True):
+    print(f"{Color.BWHITE}Changing owner{Color.NC} of {Color.LBLUE}`{p}`{Color.NC} to {user}:{group}")
+    try:
+        (uid, gid) = (_uid(user), _gid(group))
+        os.chown(p, uid, gid)
+    except (OSError, KeyError) as e:
+        _failed("changing owner of", p, e)
+        return
+
+    if recursive and os.path.isdir(p):
+        # like chown -R symlinks found while walking are changed themselves and not followed and
+        # entries that fail are reported without stopping the walk
+        for (root, dirs, files) in os.walk(p):
+            for name in dirs + files:
+                entry = os.path.join(root, name)
+                try:
+                    os.chown(entry, uid, gid, follow_symlinks=False)
+                except OSError as e:
+                    _failed("changing owner of", Path(entry), e)
+
+
+def cp(f1: Path, f2: Path):
+    """Copies file f1 to f2 or directory f1 recursively to f2."""
+    print(f"{Color.BWHITE}Copying{Color.NC} `{f1}` to {Color.LBLUE}`{f2}`{Color.NC}")
+    try:
+        if os.path.isdir(f1):
+            shutil.copytree(f1, f2, symlinks=True, dirs_exist_ok=True)
+        else:
+            shutil.copy2(f1, f2)
+    except OSError as e:
+        _failed(f"copying `{f1}` to", f2, e)
+
+
+def gitclone(repo: str, where=Path(""), depth: Optional[int] = 1, branch: Optional[str] = None):
+    """Clones repo, by default shallow clones only the tip of the default branch. Pass depth=None
+    for a full clone."""
     p = str(where)
     install_pkg_if_bin_not_exists("git")
-    Command("git", ["clone", repo, p] if p else ["clone", repo]).safe_run()
+    args = (
+        ["clone"]
+        + (["--depth", str(depth), "--single-branch"] if depth else [])
+        + (["--branch", branch] if branch else [])
+        + [repo]
+    )
+    Command("git", args + [p] if p else args).safe_run()
+
+
+def run_parallel(jobs: List[Tuple[Callable, ...]]) -> List[Any]:
+    """Runs jobs concurrently in a thread pool. Each job is a tuple of a function followed by its
+    arguments. Returns results of all jobs in order, if any of the jobs raised an exception it is
+    reraised after all jobs finished."""
+    if not jobs:
+        return []
+
+    with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(jobs))) as executor:
+        futures = [executor.submit(job[0], *job[1:]) for job in jobs]
+
+    return [future.result() for future in futures]
 
 
 def nvim(cmd: str):
     Command("nvim", ["--headless", "-c", f'"{cmd}"']).safe_run()
 
 
+def _decompressor(f: Path) -> str:
+    """Returns a multithreaded decompression program for archive f if one is available."""
+    if f.suffix in (".xz", ".txz"):
+        if _which("pixz"):
+            return "pixz -d"
+        if _which("xz"):
+            return "xz -d -T0"
+    elif f.suffix in (".gz", ".tgz") and _which("pigz"):
+        return "pigz -d"
+
+    return ""
+
+
 def extar(f: Path, to: Path):
+    decompressor = _decompressor(f)
     Command(
         "tar",
-        [
+        ([f"--use-compress-program={decompressor}"] if decompressor else [])
+        + [
             "--extract",
             f"--file={str(f)}",
             f"--directory={str(to)}",
@@ -65,11 +264,17 @@ def extar(f: Path, to: Path):
     ).safe_run()
 
 
+def download_and_extract(url: str, to: Path, decompressor="xz -d -T0"):
+    """Streams a tar archive from url directly into tar so that the download overlaps
+    with decompression and the archive is never written to disk. Requires curl to be installed."""
+    bash(
+        f"set -o pipefail; curl -fsSL {shlex.quote(url)}"
+        f" | tar --use-compress-program={shlex.quote(decompressor)} --extract --directory={shlex.quote(str(to))}"
+    )
+
+
 def _link(f: Path, to: Path):
-    Command(
-        "ln",
-        ["--symbolic", "--force", "--verbose", str(f), str(to)],
-    ).safe_run()
+    force_symlink(f, to)
 
 
 def link(base: Path, f: str, out: Path):
@@ -99,20 +304,83 @@ def create_user(user: str, password=""):
         Command("passwd", [user], opts=ExecOpts(redirect=True, follow=False)).safe_run()
 
 
+@functools.lru_cache(maxsize=1)
+def _path_index(path: str) -> Dict[str, List[str]]:
+    """Maps names of entries of all directories in path to their locations in PATH order, so the
+    first one is the same a PATH lookup would try first."""
+    index: Dict[str, List[str]] = {}
+    for d in dict.fromkeys(path.split(os.pathsep)):
+        try:
+            with os.scandir(d or ".") as entries:
+                for entry in entries:
+                    index.setdefault(entry.name, []).append(entry.path)
+        except OSError:
+            pass
+    return index
+
+
+def _which(binary: str) -> Optional[str]:
+    """Looks binary up in an index of PATH built once instead of probing every PATH directory.
+    Like shutil.which entries that aren't executable files are skipped in favour of later ones."""
+    if os.sep in binary:
+        return shutil.which(binary)
+
+    for p in _path_index(os.environ.get("PATH", os.defpath)).get(binary, ()):
+        if os.access(p, os.X_OK) and not os.path.isdir(p):
+            return p
+    return None
+
+
 def bins_exist(bins: List[str]):
-    for b in bins:
-        if shutil.which(b) is None:
-            return False
-    return True
+    return all(_which(b) is not None for b in bins)
+
+
+def installed_pkgs() -> FrozenSet[str]:
+    """Returns names of all installed packages. Packages are queried from pacman once and cached
+    until the next install_pkgs call."""
+    global _INSTALLED_PKGS
+    if _INSTALLED_PKGS is None:
+        cmd = Command("pacman", ["-Qq"], opts=ExecOpts(display=False, follow=False))
+        cmd.safe_run(reraise=False)
+        _INSTALLED_PKGS = frozenset(cmd.stdout.split()) if cmd.exit_code == 0 else frozenset()
+    return _INSTALLED_PKGS
 
 
 def install_pkgs(pkgs: List[str], pkgmngr="/usr/bin/pacman", user="root"):
-    Command("sudo", ["-u", user, pkgmngr, "--sync", "--noconfirm"] + pkgs).safe_run()
+    global _INSTALLED_PKGS
+    try:
+        # -n makes sudo fail instead of blocking on a password prompt
+        Command("sudo", ["-n", "-u", user, pkgmngr, "--sync", "--noconfirm"] + pkgs).safe_run()
+    finally:
+        _INSTALLED_PKGS = None
+        _path_index.cache_clear()
+
+
+def ensure_pkgs(pkgs: List[str], pkgmngr="/usr/bin/pacman", user="root"):
+    """Installs all pkgs that are not installed yet in a single transaction."""
+    installed = installed_pkgs()
+    missing = [pkg for pkg in pkgs if pkg not in installed]
+    if missing:
+        install_pkgs(missing, pkgmngr=pkgmngr, user=user)
 
 
 def install_pkg_if_bin_not_exists(binary: str, pkg=""):
+    pkg = pkg if pkg else binary
+    # PATH lookup is checked first as querying installed packages spawns pacman
+    if not bins_exist([binary]) and pkg not in installed_pkgs():
+        install_pkgs([pkg])
+
+
+def queue_pkg_if_bin_not_exists(binary: str, pkg=""):
+    """Queues pkg (or binary if pkg is empty) to be installed by the next flush_pending_pkgs
+    call if binary doesn't exist."""
     if not bins_exist([binary]):
-        install_pkgs([pkg if pkg else binary])
+        pkg_queue.add(pkg if pkg else binary)
+
+
+def flush_pending_pkgs(pkgs: Iterable[str] = (), pkgmngr="/usr/bin/pacman", user="root"):
+    """Installs all queued packages together with pkgs in a single package manager invocation."""
+    pkg_queue.flush(pkgs, pkgmngr=pkgmngr, user=user)
 
 
 def install_sudo():
@@ -128,11 +396,8 @@ def install_and_run_reflector():
 
 
 def build_paru():
-    install_sudo()
-
-    bld_pkgs = ["base-devel"]
-    if not bins_exist(bld_pkgs):
-        install_pkgs(bld_pkgs)
+    # everything needed to build is installed in one transaction, gitclone then finds git installed
+    ensure_pkgs(["sudo", "git", "base-devel"])
 
     with TemporaryDirectory() as tmpdir:
         gitclone(PARU_REPO, Path(f"{tmpdir}/paru"))
@@ -140,26 +405,30 @@ def build_paru():
         bash(f"usermod -d {tmpdir} nobody")
 
         sudo_nopasswd("nobody")
-        bash(f"cd {tmpdir}/paru && sudo -u nobody makepkg -srci --noconfirm")
+        Command("sudo", ["-u", "nobody", "makepkg", "-srci", "--noconfirm"], cwd=Path(tmpdir) / "paru").safe_run()
         rm_sudo_nopasswd("nobody")
 
 
 def gen_locale(locales: List[str]):
-    with open("/etc/locale.gen", "a+") as f:
-        for line in f.readlines():
-            for locale in locales:
-                if line.startswith(f"#{locale}"):
-                    line = locale
+    """Uncomments all entries of locales in /etc/locale.gen and generates them."""
+    wanted = set(locales)
+    print(f"{Color.BWHITE}Enabling locales{Color.NC} `{' '.join(locales)}` in {Color.LBLUE}`{LOCALE_GEN}`{Color.NC}")
+    # the new file is streamed next to the old one and replaces it only once fully written
+    with open(LOCALE_GEN) as src, atomic_open(LOCALE_GEN) as dst:
+        for line in src:
+            if line.startswith("#") and line[1:].split(" ", 1)[0].strip() in wanted:
+                line = line[1:]
+            dst.write(line)
 
-    Command("locale-gen", []).safe_run()
+    Command("locale-gen", [], opts=SPAWN_OPTS).safe_run()
 
 
 def set_lang(lang: str):
-    fwrite(Path("/etc/locale.conf"), "LANG=" + lang)
+    fwrite(LOCALE_CONF, "LANG=" + lang)
 
 
 def set_keymap(keymap: str):
-    fwrite(Path("/etc/vconsole.conf"), "KEYMAP=" + keymap)
+    fwrite(VCONSOLE_CONF, "KEYMAP=" + keymap)
 
 
 def set_timezone(region: str, city: str):
@@ -169,11 +438,21 @@ def set_timezone(region: str, city: str):
 
 def set_hostname(hostname: str):
     if hostname:
-        fwrite(Path("/etc/hostname"), hostname)
+        fwrite(HOSTNAME, hostname)
 
 
 def create_hosts():
-    fwrite(Path("/etc/hosts"), "127.0.0.1     localhost\n::1           localhost\n")
+    fwrite(HOSTS, HOSTS_CONTENT)
+
+
+def write_host_config(lang: str, keymap: str, hostname: str):
+    """Writes language, keymap, hostname and hosts configuration at once. Equivalent to calling
+    set_lang, set_keymap, set_hostname and create_hosts but syncs /etc only once."""
+    files = [(LOCALE_CONF, "LANG=" + lang), (VCONSOLE_CONF, "KEYMAP=" + keymap), (HOSTS, HOSTS_CONTENT)]
+    if hostname:
+        files.append((HOSTNAME, hostname))
+
+    fwrite_many(files)
 
 
 def sudo_nopasswd(user: str):
@@ -186,5 +465,5 @@ def rm_sudo_nopasswd(user: str):
         os.remove(p)
 
 
-def systemctl_enable(service: str):
-    Command("systemctl", ["enable", service]).safe_run()
+def systemctl_enable(*services: str):
+    Command("systemctl", ["enable", *services]).safe_run()
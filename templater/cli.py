@@ -11,16 +11,20 @@ CLI tool to manage themes and configurations with multiple color schemes.
 import json
 import argparse
 import sys
-import yaml
 import traceback
 import time
+import os
+import stat
+import shutil
+import tarfile
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, Optional, Any
-from tempfile import TemporaryDirectory
+from typing import Dict, Optional, Any, Tuple, List, Callable, Iterator, IO
 
 sys.path.append(str(Path(__file__).absolute().parent.parent) + "/")
-from util import catch_errs, Color, eprint, Command, bash, ExecOpts
-from templater import Templater
+from util import catch_errs, Color, eprint, atomic_open, outw_bytes
+from templater import CompiledTemplate
 
 ################################################################################
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ classes ~~~~~~~~~~~|
@@ -28,6 +32,41 @@ from templater import Templater
 
 Config = Dict[str, Any]
 ThemesConfig = Dict[str, Dict[str, str]]
+Backup = Tuple[tarfile.TarInfo, IO[bytes]]
+
+# max number of files rendered concurrently by `run`
+MAX_WORKERS = 16
+
+# compiled templates keyed by path and modification time of the template file
+_TEMPLATES: Dict[Tuple[str, int], CompiledTemplate] = {}
+
+
+def _compile_file(file: Path) -> CompiledTemplate:
+    key = (str(file), file.stat().st_mtime_ns)
+    template = _TEMPLATES.get(key)
+    if template is None:
+        template = _TEMPLATES[key] = CompiledTemplate(file.read_text())
+    return template
+
+
+def _backup(p: Path) -> Backup:
+    """Copies file p to an anonymous temporary file that never appears in the filesystem. Returns
+    the copy together with archive metadata of p."""
+    backup = tempfile.TemporaryFile()
+    try:
+        with open(p, "rb") as f:
+            shutil.copyfileobj(f, backup)
+            st = os.fstat(f.fileno())
+    except BaseException:
+        backup.close()
+        raise
+
+    info = tarfile.TarInfo(p.name)
+    (info.size, info.mtime, info.mode) = (backup.tell(), st.st_mtime, stat.S_IMODE(st.st_mode))
+    (info.uid, info.gid) = (st.st_uid, st.st_gid)
+    backup.seek(0)
+
+    return (info, backup)
 
 
 class TempalterCli(object):
@@ -49,15 +88,24 @@ class TempalterCli(object):
 
     def __init__(self):
         self.args = self.__parser().parse_args()
+
+    def _load_config(self):
+        """Reads configuration and themes, deferred until a command actually needs them."""
         self.config = self._read_config_file(self.args.config[0])
         self.theme = self._get_theme(self.args.theme[0])
         self.defaults = self._get_theme("default") if "default" in self.config["themes"].keys() else {}
+        # theme merged over defaults once and shared by all rendered files
+        self.lookup = {**self.defaults, **self.theme}
 
     @staticmethod
     def _read_config_file(location: Path) -> Config:
+        # yaml is only imported once a configuration is read as it's slow to import
+        import yaml
+
         try:
             with location.open() as f:
-                var = yaml.load(f, Loader=yaml.Loader)
+                # libyaml based loader is used when PyYAML was built with it
+                var = yaml.load(f, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
                 if isinstance(var, dict):
                     return var
         except yaml.YAMLError as e:
@@ -89,55 +137,79 @@ class TempalterCli(object):
 
         return self.config["themes"][theme]
 
-    def _render_file(self, file: Path) -> str:
-        with open(file, "r") as f:
-            text = f.read()
-            return Templater(text, self.theme, default=self.defaults).render()
+    def _render_file(self, file: Path) -> Iterator[str]:
+        return _compile_file(file).render_iter(self.lookup)
 
     def __render(self):
-        print(self._render_file(self.args.file[0]))
+        self._load_config()
+        # rendered straight to bytes as the template's literals are already encoded
+        outw_bytes(_compile_file(self.args.file[0]).render_bytes(self.lookup), b"\n")
+
+    def _run_file(self, inp_p: str, out_p: str, backups: List[Backup]) -> List[Tuple[Callable, str]]:
+        """Backs up existing output file to backups and renders inp_p to out_p. Returns messages
+        with functions that print them."""
+        p = Path(out_p).expanduser()
+
+        if p.is_dir():
+            return [(eprint, f"Output path {Color.YELLOW}`{p}`{Color.RED} is a directory, skipping.\n")]
+
+        messages = []
+        if p.exists():
+            messages.append(
+                (print, f"{Color.BWHITE}Backing up {Color.YELLOW}`{p}`{Color.BWHITE}, file already exists.{Color.NC}")
+            )
+            try:
+                backups.append(_backup(p))
+            except Exception as e:
+                # existing file is not overwritten when it couldn't be backed up
+                messages.append((eprint, f"Failed backing up file {Color.YELLOW}`{p}`{Color.RED} - {e}, skipping.\n"))
+                messages.append((print, f"{Color.CYAN}{'~' * 80}{Color.NC}"))
+                return messages
+
+        messages.append(
+            (print, f"{Color.BWHITE}Rendering {Color.YELLOW}`{inp_p}`{Color.RED} ~~~~~> {Color.YELLOW}`{p}`{Color.NC}")
+        )
+        try:
+            pieces = self._render_file(Path(inp_p))
+            # rendered to a temporary file replacing p only once the whole file is rendered so that a
+            # failed render leaves p untouched
+            with atomic_open(p, "w") as f:
+                f.writelines(pieces)
+        except Exception as e:
+            messages.append((eprint, f"Failed rendering file {Color.YELLOW}`{inp_p}`{Color.RED} - {e}\n"))
+        messages.append((print, f"{Color.CYAN}{'~' * 80}{Color.NC}"))
+
+        return messages
 
     def __run(self):
+        self._load_config()
         if "files" not in self.config.keys():
             eprint(f"Missing {Color.BWHITE}`files`{Color.NC} in configuration")
             sys.exit(1)
 
-        start = time.time()
-        with TemporaryDirectory() as tempdir:
+        start = time.perf_counter()
+        files = list(self.config["files"].items())
+        backups: List[Backup] = []
+        try:
+            print(f"{Color.CYAN}{'~' * 80}{Color.NC}")
+            with ThreadPoolExecutor(max_workers=max(1, min(MAX_WORKERS, len(files)))) as executor:
+                # files are processed concurrently but their messages are printed in order
+                for messages in executor.map(lambda f: self._run_file(f[0], f[1], backups), files):
+                    for (w, msg) in messages:
+                        w(msg)
+        finally:
+            print(f"{Color.BWHITE}Creating archive of backed up configs{Color.NC}")
             try:
-                print(f"{Color.CYAN}{'~' * 80}{Color.NC}")
-                for (inp_p, out_p) in self.config["files"].items():
-                    p = Path(out_p).expanduser()
-
-                    if p.is_dir():
-                        eprint(f"Output path {Color.YELLOW}`{p}`{Color.RED} is a directory, skipping.\n")
-                        continue
-
-                    if p.exists():
-                        print(
-                            f"{Color.BWHITE}Backing up {Color.YELLOW}`{p}`{Color.BWHITE}, file already exists.{Color.NC}"
-                        )
-                        Command(
-                            "cp", [str(p), str(Path(tempdir) / p.name)], opts=ExecOpts(follow=False, display=False)
-                        ).safe_run()
-
-                    print(
-                        f"{Color.BWHITE}Rendering {Color.YELLOW}`{inp_p}`{Color.RED} ~~~~~> {Color.YELLOW}`{p}`{Color.NC}"
-                    )
-                    try:
-                        rendered = self._render_file(Path(inp_p))
-                        with open(p, "w") as f:
-                            f.write(rendered)
-                    except Exception as e:
-                        eprint(f"Failed rendering file {Color.YELLOW}`{inp_p}`{Color.RED} - {e}\n")
-                    print(f"{Color.CYAN}{'~' * 80}{Color.NC}")
+                with tarfile.open(f"templater_backup_{int(time.time())}.tgz", "w:gz") as archive:
+                    for (info, backup) in sorted(backups, key=lambda b: b[0].name):
+                        archive.addfile(info, backup)
+            except Exception as e:
+                eprint(f"Failed creating archive of backed up configs - {e}\n")
             finally:
-                print(f"{Color.BWHITE}Creating archive of backed up configs{Color.NC}")
-                bash(
-                    f"export START=$PWD && cd {tempdir} && tar -zcf $START/templater_backup_{int(time.time())}.tgz . > /dev/null 2>&1"
-                )
-                print(f"{Color.CYAN}{'~' * 80}{Color.NC}")
-        end = time.time()
+                for (_, backup) in backups:
+                    backup.close()
+            print(f"{Color.CYAN}{'~' * 80}{Color.NC}")
+        end = time.perf_counter()
         print(f"{Color.BWHITE}Finished in: {Color.GREEN}{end - start:.3f} s{Color.NC}")
 
     def _process_args(self):
@@ -1,34 +1,18 @@
-from typing import Optional, Any, List, Dict
+import re
+from functools import cached_property
+from typing import Any, List, Dict, NamedTuple, Iterator, Iterable
 from enum import Enum
 
+MISSING = "`MISSING VARIABLE {}`"
 
-class TextReader(object):
-    def __init__(self, text: str):
-        self.text = text
-        self.length = len(text)
-        self.idx = 0
-
-    def current(self) -> Optional[str]:
-        if self.text:
-            return self.text[self.idx]
-        else:
-            return None
-
-    def peek(self) -> Optional[str]:
-        if self.idx + 1 >= self.length:
-            return None
-        else:
-            return self.text[self.idx + 1]
+# formatted MISSING markers keyed by variable name
+_MISSING_CACHE: Dict[str, str] = {}
 
-    def next(self) -> Optional[str]:
-        if self.peek() != None:
-            self.idx += 1
-            return self.current()
-        else:
-            return None
-
-    def is_last(self) -> bool:
-        return self.idx == (self.length - 1)
+# variable name surrounded by double braces optionally padded with spaces, eg. `{{ some.var_1 }}`.
+# Trailing padding is only allowed after a non empty name so that an unclosed `{{` followed by a
+# long run of spaces fails in linear time instead of retrying every split of the run between the
+# leading and trailing padding. An empty name, eg. `{{  }}`, leaves the group unset.
+VAR_RE = re.compile(r"\{\{ *(?:([\w.]+) *)?\}\}")
 
 
 class TokenType(Enum):
@@ -36,19 +20,10 @@ class TokenType(Enum):
     VARIABLE = 2
 
 
-class Token(object):
-    def __init__(self, text: str, type_: TokenType, variable=""):
-        self.text = text
-        self.type = type_
-
-        if type_ == TokenType.VARIABLE:
-            self.variable = variable
-
-    def __eq__(self, other):
-        if isinstance(other, Token):
-            return self.text == other.text and self.type == other.type
-        else:
-            return False
+class Token(NamedTuple):
+    text: str
+    type: TokenType
+    variable: str = ""
 
     def __repr__(self):
         if self.type == TokenType.NORMAL:
@@ -58,95 +33,108 @@ class Token(object):
 
 
 class Lexer(object):
+    __slots__ = ("text",)
+
     def __init__(self, text: str):
-        self.reader = TextReader(text)
-
-    def parse_variable_token(self) -> Optional[Any]:
-        text = self.reader.current()  # add first '{'
-        variable = ""
-        if self.reader.current() != "{" or self.reader.peek() != "{":
-            return Token(text, TokenType.NORMAL)
-
-        text += self.reader.next()  # add second '{'
-
-        while self.reader.peek() != "}":
-            _next = self.reader.next()
-            if _next == None:
-                return Token(text, TokenType.NORMAL)
-
-            text += _next
-            if _next.isalnum() or _next == "." or _next == "_":
-                variable += _next
-            elif _next == " ":
-                if not variable or self.reader.peek() == " " or self.reader.peek() == "}":
-                    continue
-                else:
-                    return Token(text, TokenType.NORMAL)
-            else:
-                return Token(text, TokenType.NORMAL)
-
-        text += self.reader.next()  # add first '}'
-        if self.reader.peek() != "}":
-            return Token(text, TokenType.NORMAL)
-        text += self.reader.next()  # add second '}'
-        self.reader.next()
-
-        return Token(text, TokenType.VARIABLE, variable=variable)
+        self.text = text
 
     def lex(self) -> List[Token]:
         tokens = []
+        (text, normal, variable) = (self.text, TokenType.NORMAL, TokenType.VARIABLE)
 
-        text = ""
-        while True:
-            if self.reader.current() == "{" and self.reader.peek() == "{":
-                token = self.parse_variable_token()
-                if token.type == TokenType.NORMAL:
-                    text += token.text
-                    self.reader.next()
-                else:
-                    if text:
-                        tokens.append(Token(text, TokenType.NORMAL))
-                        text = ""
-                    tokens.append(token)
-
-                # early exit because "}" is already parsed and if it breaks out
-                # it will get added as an extra token
-                if self.reader.is_last():
-                    break
-            elif self.reader.current() == None:
-                break
-            else:
-                text += self.reader.current()
-                self.reader.next()
-
-            if self.reader.is_last():
-                if self.reader.current() != None:
-                    text += self.reader.current()
-                break
-
-        if text:
-            tokens.append(Token(text, TokenType.NORMAL))
+        pos = 0
+        for m in VAR_RE.finditer(text):
+            if m.start() > pos:
+                tokens.append(Token(text[pos : m.start()], normal))
+            tokens.append(Token(m.group(0), variable, m.group(1) or ""))
+            pos = m.end()
+
+        if pos < len(text):
+            tokens.append(Token(text[pos:], normal))
 
         return tokens
 
 
+def _lookup(variables: Dict[str, Any], default: Dict[str, Any]) -> Dict[str, Any]:
+    """Merges variables with default values so that each variable takes a single lookup."""
+    return {**default, **variables} if default else variables
+
+
+def _missing(variable: str) -> str:
+    marker = _MISSING_CACHE.get(variable)
+    if marker is None:
+        marker = _MISSING_CACHE[variable] = MISSING.format(variable)
+    return marker
+
+
+def _value(variable: str, lookup: Dict[str, Any]) -> str:
+    if variable in lookup:
+        return str(lookup[variable])
+    else:
+        return _missing(variable)
+
+
+class CompiledTemplate(object):
+    """Template split once into literal text and names of variables in between so that it can be
+    rendered repeatedly without scanning the text again."""
+
+    def __init__(self, text: str):
+        parts = VAR_RE.split(text)
+        self.literals = parts[0::2]
+        self.variables = [variable or "" for variable in parts[1::2]]
+
+    def render(self, variables: Dict[str, Any], default: Dict[str, Any] = {}) -> str:
+        lookup = _lookup(variables, default)
+        parts = [""] * (len(self.literals) + len(self.variables))
+        parts[0::2] = self.literals
+        parts[1::2] = [_value(variable, lookup) for variable in self.variables]
+        return "".join(parts)
+
+    @cached_property
+    def _encoded_literals(self) -> List[bytes]:
+        return [literal.encode() for literal in self.literals]
+
+    def render_bytes(self, variables: Dict[str, Any], default: Dict[str, Any] = {}) -> bytes:
+        """Renders this template as UTF-8. Literals are encoded once and reused by every render so
+        only values of variables are encoded."""
+        lookup = _lookup(variables, default)
+        parts = [b""] * (len(self.literals) + len(self.variables))
+        parts[0::2] = self._encoded_literals
+        parts[1::2] = [_value(variable, lookup).encode() for variable in self.variables]
+        return b"".join(parts)
+
+    def render_many(self, varsets: Iterable[Dict[str, Any]], default: Dict[str, Any] = {}) -> List[str]:
+        """Renders this template once for every set of variables in varsets."""
+        return [self.render(variables, default) for variables in varsets]
+
+    def render_iter(self, variables: Dict[str, Any], default: Dict[str, Any] = {}) -> Iterator[str]:
+        """Yields rendered template piece by piece so that it can be written out without
+        building the whole output in memory."""
+        lookup = _lookup(variables, default)
+        literals = iter(self.literals)
+        yield next(literals)
+        for (variable, literal) in zip(self.variables, literals):
+            yield _value(variable, lookup)
+            yield literal
+
+
 class Templater(object):
+    __slots__ = ("text", "variables", "default", "_lookup")
+
     def __init__(self, text: str, variables: Dict[str, Any], default: Dict[str, Any] = {}):
-        self.tokens = Lexer(text).lex()
+        self.text = text
         self.variables = variables
         self.default = default
+        self._lookup = _lookup(variables, default)
+
+    def _replace(self, m: re.Match) -> str:
+        return _value(m.group(1) or "", self._lookup)
 
     def render(self) -> str:
-        s = ""
-        for token in self.tokens:
-            if token.type == TokenType.NORMAL:
-                s += token.text
-            elif token.type == TokenType.VARIABLE:
-                if token.variable in self.variables.keys():
-                    s += str(self.variables[token.variable])
-                elif token.variable in self.default.keys():
-                    s += str(self.default[token.variable])
-                else:
-                    s += f"`MISSING VARIABLE {token.variable}`"
-
-        return s
+        """Renders the template substituting variables in a single pass over the text without
+        lexing it into tokens first."""
+        return VAR_RE.sub(self._replace, self.text)
+
+    def compile(self) -> CompiledTemplate:
+        """Compiles text of this templater for rendering it repeatedly with different variables."""
+        return CompiledTemplate(self.text)
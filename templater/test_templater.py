@@ -1,7 +1,7 @@
 #!/usr/bin/env python
 
 import unittest
-from templater import Lexer, TokenType, Token, Templater
+from templater import Lexer, TokenType, Token, Templater, CompiledTemplate
 
 
 class TestLexer(unittest.TestCase):
@@ -19,6 +19,13 @@ class TestLexer(unittest.TestCase):
 
         self.assertEqual(got, want)
 
+    def test_parses_unfinished_token_with_padding(self):
+        inp = "{{" + " " * 50000 + "x"
+        got = Lexer(inp).lex()
+        want = [Token(inp, TokenType.NORMAL)]
+
+        self.assertEqual(got, want)
+
     def test_doesnt_parse_comma_in_variable(self):
         inp = """{{  xx,y }}"""
         got = Lexer(inp).lex()
@@ -122,6 +129,39 @@ class TestLexer(unittest.TestCase):
 
         self.assertEqual(got, want)
 
+    def test_parses_variable_after_extra_brace(self):
+        inp = """P{{{1a}}QQ"""
+        got = Lexer(inp).lex()
+        want = [
+            Token("P{", TokenType.NORMAL),
+            Token("{{1a}}", TokenType.VARIABLE, variable="1a"),
+            Token("QQ", TokenType.NORMAL),
+        ]
+
+        self.assertEqual(got, want)
+
+    def test_parses_variable_nested_in_invalid_variable(self):
+        inp = """P,{{ 1{{_}}_QQ"""
+        got = Lexer(inp).lex()
+        want = [
+            Token("P,{{ 1", TokenType.NORMAL),
+            Token("{{_}}", TokenType.VARIABLE, variable="_"),
+            Token("_QQ", TokenType.NORMAL),
+        ]
+
+        self.assertEqual(got, want)
+
+    def test_keeps_text_after_last_variable(self):
+        inp = """{{ x }}\n"""
+
+        got = Lexer(inp).lex()
+        want = [
+            Token("{{ x }}", TokenType.VARIABLE, variable="x"),
+            Token("\n", TokenType.NORMAL),
+        ]
+
+        self.assertEqual(got, want)
+
 
 class TestTemplater(unittest.TestCase):
     def test_replacing(self):
@@ -148,10 +188,38 @@ some.working.var1 = 123
 some.working.var2 = 123
 some.working.var3 = "example text"
 some.working.var4 = "example text"
-some.missing.var1 = `MISSING VARIABLE z`"""
+some.missing.var1 = `MISSING VARIABLE z`
+"""
 
         self.assertEqual(got, want)
 
 
+class TestCompiledTemplate(unittest.TestCase):
+    def test_renders_like_templater(self):
+        inp = """{{ x }} and {{y}} but not { z }, {{ w }}\n"""
+        variables = {"x": 1, "y": "two"}
+        default = {"w": 3.0}
+        template = CompiledTemplate(inp)
+
+        want = Templater(inp, variables, default=default).render()
+        self.assertEqual(template.render(variables, default=default), want)
+        self.assertEqual(template.render(variables, default=default), want)
+        self.assertEqual("".join(template.render_iter(variables, default=default)), want)
+        self.assertEqual(template.render_bytes(variables, default=default), want.encode())
+
+    def test_renders_many_variable_sets(self):
+        template = Templater("""{{ x }}-{{ y }}""", {}).compile()
+        got = template.render_many([{"x": 1, "y": 2}, {"x": "a"}], default={"y": "b"})
+        want = ["1-2", "a-b"]
+
+        self.assertEqual(got, want)
+
+    def test_renders_text_without_variables(self):
+        inp = """just text"""
+        got = CompiledTemplate(inp).render({})
+
+        self.assertEqual(got, inp)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -9,14 +9,21 @@ Utility funcs and classes for creating interactive cli scripts
 ################################################################################
 
 import sys
+import io
+import os
+import selectors
 import subprocess
+import threading
 import termios
 import tty
 import traceback
 import time
-from typing import List, Callable, Any, Optional, IO
+import stat
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from typing import List, Callable, Any, Optional, IO, Iterable, Tuple
 from pathlib import Path
-from enum import Enum
 
 
 ################################################################################
@@ -28,14 +35,30 @@ MEGA = KILO * KILO
 GIGA = MEGA * KILO
 TERA = GIGA * KILO
 
+# upper bounds (inclusive) of sizes displayed in each unit by conv_b
+_SIZE_BOUNDS = (KILO, MEGA, GIGA, TERA)
+_SIZE_SCALES = (1, KILO, MEGA, GIGA, TERA)
+_SIZE_UNITS = ("B", "KB", "MB", "GB", "TB")
+
+# max number of bytes read from a subprocess pipe at once
+READ_SIZE = 64 * 1024
+
+# max number of steps executed concurrently by run_steps
+MAX_STEP_WORKERS = 8
+
+
+# terminal state of the current thread, see raw_mode
+_terminal = threading.local()
+
 
 ################################################################################
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ classes ~~~~~~~~~~~|
 ################################################################################
 
 
-class Color(Enum):
-    """Enumeration containing exit codes responsible for adjusting color of terminal output"""
+class Color(object):
+    """Escape codes responsible for adjusting color of terminal output. Codes are plain strings so
+    they are interpolated and joined without any conversion, disable replaces them with empty strings."""
 
     LBLUE = "\033[1;94m"
     CYAN = "\033[0;36m"
@@ -45,26 +68,39 @@ class Color(Enum):
     BWHITE = "\033[1;37m"
     NC = "\033[0m"
 
-    _enable = True
-
-    def __str__(self):
-        if self._enable:
-            return self.value
-
-        return ""
-
     @staticmethod
     def disable():
-        for color in COLORS:
-            color._enable = False
+        for name in COLORS:
+            setattr(Color, name, "")
+        _compile_templates()
 
     @staticmethod
     def enable():
-        for color in COLORS:
-            color._enable = True
+        for (name, code) in COLORS.items():
+            setattr(Color, name, code)
+        _compile_templates()
+
+
+COLORS = {name: code for (name, code) in vars(Color).items() if name.isupper()}
 
 
-COLORS = [Color.LBLUE, Color.CYAN, Color.GREEN, Color.YELLOW, Color.RED, Color.BWHITE, Color.NC]
+def _compile_templates():
+    """Formats colored message templates used on every prompt and command, has to be rerun
+    whenever colors are enabled or disabled."""
+    global _YN_SUFFIX, _DEFAULT_TPL, _RUNNING_TPL, _WRITING_TPL, _LINKING_TPL
+    (c, nc) = (Color, Color.NC)
+    _YN_SUFFIX = f" {c.GREEN}y(es){nc}/{c.RED}n(o){nc}/{c.YELLOW}q(uit){nc}: "
+    _DEFAULT_TPL = f"(default - '{c.YELLOW}%s{nc}'): "
+    _RUNNING_TPL = f"{c.BWHITE}Running{nc} `%s`"
+    _WRITING_TPL = f"{c.BWHITE}Writing{nc} `%s` to {c.LBLUE}`%s`{nc}"
+    _LINKING_TPL = f"{c.BWHITE}Linking{nc} `%s` to {c.LBLUE}`%s`{nc}"
+
+
+# colors are only written to terminals, piped output stays free of escape codes
+if sys.stdout is not None and sys.stdout.isatty():
+    Color.enable()
+else:
+    Color.disable()
 
 
 class ExecOpts(object):
@@ -103,10 +139,15 @@ class Command(object):
     parameters allowing adjustment of command execution.
     """
 
-    def __init__(self, cmd: str, args: List[str], opts: ExecOpts = DEFAULT_OPTS):
+    __slots__ = ("cmd", "args", "opts", "cwd", "_argv", "_cmdline", "subprocess", "exit_code", "stdout", "stderr")
+
+    def __init__(self, cmd: str, args: List[str], opts: ExecOpts = DEFAULT_OPTS, cwd: Optional[Path] = None):
         self.cmd = cmd
         self.args = args
         self.opts = opts
+        self.cwd = cwd
+        self._argv = [cmd] + args
+        self._cmdline = f"{cmd} {' '.join(args)}"
 
         self.subprocess = None
         self.exit_code = None
@@ -115,59 +156,92 @@ class Command(object):
 
     def _subprocess(self) -> subprocess.Popen:
         if not self.opts.redirect:
-            return subprocess.Popen([self.cmd] + self.args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            # fds are non-inheritable by default so there is nothing to close in the child and
+            # skipping close_fds saves it a pass over all open fds before exec. Commands are given
+            # by bare name so Popen doesn't take its posix_spawn path, the child is started with
+            # _posixsubprocess which uses vfork since Python 3.10. Pipes are unbuffered as they
+            # are only ever read in large chunks straight from their fds
+            return subprocess.Popen(
+                self._argv,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                cwd=self.cwd,
+                close_fds=False,
+                bufsize=0,
+            )
         else:
-            return subprocess.Popen([self.cmd] + self.args, stdout=sys.stdout, stderr=sys.stderr)
-
-    def _follow_stdout(self):
-        try:
-            if self.opts.display:
-                outw(Color.GREEN)
-            self.stdout = ""
-            for c in iter(lambda: self.subprocess.stdout.read(1), b""):
-                try:
-                    ch = c.decode("utf-8")
+            return subprocess.Popen(self._argv, stdout=sys.stdout, stderr=sys.stderr, cwd=self.cwd)
+
+    def _follow(self):
+        """Relays stdout and stderr of the subprocess as soon as any of them has data available
+        collecting the output if specified in opts."""
+        collected = {"stdout": bytearray(), "stderr": bytearray()}
+        with selectors.DefaultSelector() as sel:
+            for (f, name, write, color) in (
+                (self.subprocess.stdout, "stdout", outw_bytes, Color.GREEN),
+                (self.subprocess.stderr, "stderr", errw_bytes, Color.RED),
+            ):
+                (start, end) = (color.encode(), Color.NC.encode()) if self.opts.display else (b"", b"")
+                sel.register(f, selectors.EVENT_READ, (collected[name], write, start, end))
+
+            while sel.get_map():
+                for (key, _) in sel.select():
+                    data = os.read(key.fd, READ_SIZE)
+                    if not data:
+                        sel.unregister(key.fileobj)
+                        continue
+
+                    (buf, write, start, end) = key.data
                     if self.opts.collect:
-                        self.stdout += ch
-                    outw(ch, flush=False)
-                except:
-                    pass
-            sys.stderr.flush()
-        finally:
-            if self.opts.display:
-                outw(Color.NC)
+                        buf += data
+                    write(start, data, end)
 
-    def _follow_stderr(self):
-        try:
-            if self.opts.display:
-                errw(Color.RED)
-            self.stderr = ""
-            for c in iter(lambda: self.subprocess.stderr.read(1), b""):
-                try:
-                    ch = c.decode("utf-8")
-                    if self.opts.collect:
-                        self.stderr += ch
-                    errw(ch, flush=False)
-                except:
-                    pass
-            sys.stderr.flush()
-        finally:
-            if self.opts.display:
-                errw(Color.NC)
+        # decoded once at the end so that multibyte characters split between reads are kept intact
+        self.stdout = collected["stdout"].decode(errors="replace")
+        self.stderr = collected["stderr"].decode(errors="replace")
 
     def _run_follow(self):
         self.subprocess = self._subprocess()
-        self._follow_stdout()
-        self._follow_stderr()
+        self._follow()
         self.subprocess.communicate()
         self.exit_code = self.subprocess.returncode
 
-    def _run(self):
+    def _run_spawn(self):
+        self.exit_code = run_fast(self._argv)
+        (self.stdout, self.stderr) = ("", "")
+
+    def _run_wait(self):
+        """Runs a redirected command that writes directly to stdout and stderr of this process,
+        there is nothing to read so the process is only waited for."""
+        sys.stdout.flush()
+        sys.stderr.flush()
         self.subprocess = self._subprocess()
-        (self.stdout, self.stderr) = map(
-            lambda x: "" if x is None else x.decode("utf-8"), self.subprocess.communicate()
-        )
-        self.exit_code = self.subprocess.returncode
+        self.exit_code = self.subprocess.wait()
+        (self.stdout, self.stderr) = ("", "")
+
+    def _run_memfd(self):
+        """Spawns the command with stdout and stderr redirected to in-memory files that are read
+        once the command exits, there are no pipes to drain while it runs."""
+        fds = [os.memfd_create(name, os.MFD_CLOEXEC) for name in ("stdout", "stderr")]
+        try:
+            self.exit_code = run_fast(
+                self._argv, file_actions=[(os.POSIX_SPAWN_DUP2, fds[0], 1), (os.POSIX_SPAWN_DUP2, fds[1], 2)]
+            )
+            (self.stdout, self.stderr) = (os.pread(fd, os.fstat(fd).st_size, 0).decode("utf-8") for fd in fds)
+        finally:
+            for fd in fds:
+                os.close(fd)
+
+    def _run(self):
+        if self.cwd is None and hasattr(os, "memfd_create"):
+            self._run_memfd()
+        else:
+            self.subprocess = self._subprocess()
+            (self.stdout, self.stderr) = map(
+                lambda x: "" if x is None else x.decode("utf-8"), self.subprocess.communicate()
+            )
+            self.exit_code = self.subprocess.returncode
+
         if self.exit_code != 0:
             if self.opts.display and self.stderr:
                 eprint("ERROR: " + self.stderr)
@@ -176,13 +250,18 @@ class Command(object):
                 outw(Color.GREEN, self.stdout, Color.NC)
 
     def __repr__(self):
-        return f"{Color.LBLUE}{self.cmd} {' '.join(self.args)}{Color.NC}"
+        return f"{Color.LBLUE}{self._cmdline}{Color.NC}"
 
     def run(self):
         """Runs this command in a subprocess."""
-        print(f"{Color.BWHITE}Running{Color.NC} `{self}`")
-
-        if self.opts.follow:
+        print(_RUNNING_TPL % self)
+
+        if self.opts.redirect:
+            if self.cwd is None:
+                self._run_spawn()
+            else:
+                self._run_wait()
+        elif self.opts.follow:
             self._run_follow()
         else:
             self._run()
@@ -215,6 +294,8 @@ class Step(object):
     a y/n question. If the users answer is yes, function func will be called with
     args."""
 
+    __slots__ = ("message", "func", "args")
+
     def __init__(self, message: str, func: Callable, *args: Any):
         self.message = message
         self.func = func
@@ -229,6 +310,87 @@ class Step(object):
             ask_user_yn(self.message, self.func, ask=ask)
 
 
+class Timer(object):
+    """Elapsed time of a block measured by timed, elapsed is set once the block exits."""
+
+    __slots__ = ("start", "elapsed")
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.elapsed = 0.0
+
+
+class _BashPool(object):
+    """A long lived bash process executing scripts sent to it one at a time, each in its own
+    subshell so that scripts don't share state. Saves starting a new bash for every script.
+    Scripts inherit stdin, stdout and stderr of this process."""
+
+    # reads NUL terminated call id, working directory and script from fd R and writes the call id
+    # with exit status to fd W. Scripts run with both fds closed so that nothing they start can
+    # write to the status pipe.
+    LOOP = (
+        'while IFS= read -r -d "" id <&{r} && IFS= read -r -d "" dir <&{r} && IFS= read -r -d "" cmd <&{r}; do'
+        ' (exec {r}<&- {w}>&-; cd -- "$dir" && eval "$cmd"); echo "$id $?" >&{w}; done'
+    )
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.process = None
+        self.env = None
+        self.calls = 0
+
+    def _start(self):
+        (cmd_r, self.cmd_w) = os.pipe()
+        (status_r, status_w) = os.pipe()
+        try:
+            self.env = dict(os.environ)
+            self.process = subprocess.Popen(
+                ["/bin/bash", "-c", self.LOOP.format(r=cmd_r, w=status_w)], pass_fds=(cmd_r, status_w)
+            )
+        finally:
+            os.close(cmd_r)
+            os.close(status_w)
+        self.status = open(status_r, "rb")
+
+    def _stop(self):
+        os.close(self.cmd_w)
+        self.status.close()
+        self.process.wait()
+        self.process = None
+
+    def run(self, cmd: str) -> Optional[int]:
+        """Runs bash script cmd in the current working directory and returns its exit code. Returns
+        None without running anything if the pool is busy running a script from another thread."""
+        if not self.lock.acquire(blocking=False):
+            return None
+        try:
+            if self.process is not None and (self.process.poll() is not None or self.env != os.environ):
+                self._stop()
+            if self.process is None:
+                self._start()
+
+            self.calls += 1
+            call = str(self.calls)
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os.write(self.cmd_w, f"{call}\0{os.getcwd()}\0{cmd}\0".encode())
+            while True:
+                status = self.status.readline().split()
+                if not status:
+                    self._stop()
+                    raise ChildProcessError(f"shared bash process exited while running `{cmd}`")
+                if status[0].decode() == call:
+                    return int(status[1])
+                # status left over from an earlier interrupted call, the pool is restarted
+                # on the next call so that nothing else is queued behind it
+                self.env = None
+        finally:
+            self.lock.release()
+
+
+bash_pool = _BashPool()
+
+
 ################################################################################
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ funcs ~~~~~~~~~~~~~|
 ################################################################################
@@ -237,11 +399,48 @@ class Step(object):
 def _w(fd: IO, *items: Any, flush: bool = True):
     """Writes all items to specified file descriptor and flushes the fd if flush is set
     to True."""
-    fd.write("".join([item.__str__() for item in items]))
+    if len(items) == 1:
+        item = items[0]
+        fd.write(item if type(item) is str else str(item))
+    elif all(type(item) is str for item in items):
+        fd.write("".join(items))
+    else:
+        fd.write("".join(map(str, items)))
     if flush:
         fd.flush()
 
 
+def _wb(fd: IO, *chunks: bytes, flush: bool = True):
+    """Writes raw bytes to the binary buffer underlying text stream fd skipping the encoding
+    step. Pending text is flushed first to keep the order of writes."""
+    fd.flush()
+    buf = getattr(fd, "buffer", None)
+    if buf is None:
+        fd.write(b"".join(chunks).decode(errors="replace"))
+    else:
+        buf.write(chunks[0] if len(chunks) == 1 else b"".join(chunks))
+        if flush:
+            buf.flush()
+
+
+def _wv(fd: IO, *items: str):
+    """Writes all items to the file descriptor underlying fd with a single writev call without
+    joining them first. Pending output of fd is flushed first to keep the order of writes. Falls
+    back to _w if fd isn't backed by a file descriptor."""
+    try:
+        fileno = fd.fileno()
+    except (AttributeError, io.UnsupportedOperation):
+        return _w(fd, *items)
+
+    fd.flush()
+    data = [item.encode() for item in items]
+    written = os.writev(fileno, data)
+    if written < sum(map(len, data)):
+        rest = memoryview(b"".join(data))[written:]
+        while rest:
+            rest = rest[os.write(fileno, rest) :]
+
+
 def errw(*items: Any, flush: bool = True):
     """Writes out all items to stderr converting them to string. If flush is set to True
     stderr will be flushed after the write."""
@@ -254,6 +453,18 @@ def outw(*items: Any, flush: bool = True):
     _w(sys.stdout, *items, flush=flush)
 
 
+def errw_bytes(*chunks: bytes, flush: bool = True):
+    """Writes out raw bytes to stderr without decoding and re-encoding them, eg. output relayed
+    from a subprocess."""
+    _wb(sys.stderr, *chunks, flush=flush)
+
+
+def outw_bytes(*chunks: bytes, flush: bool = True):
+    """Writes out raw bytes to stdout without decoding and re-encoding them, eg. output relayed
+    from a subprocess."""
+    _wb(sys.stdout, *chunks, flush=flush)
+
+
 def eprint(msg: str):
     """Prints a message to stderr in red color."""
     errw(Color.RED, msg, Color.NC)
@@ -269,53 +480,150 @@ def inp(msg: str) -> str:
 
 def inp_or_default(msg: str, default: str) -> str:
     """Asks user for input printing msg first. If users input is empty uses default as return."""
-    x = inp(msg + f"(default - '{Color.YELLOW}{default}{Color.NC}'): ")
+    x = inp(msg + _DEFAULT_TPL % default)
     return x if x else default
 
 
+def run_fast(argv: List[str], file_actions: Iterable[Tuple] = ()) -> int:
+    """Spawns argv with posix_spawn, which avoids copying the interpreter's memory like fork does,
+    and waits for it to finish. The process inherits stdin, stdout and stderr unless changed by
+    file_actions (see os.posix_spawn). Returns exit code of the process."""
+    # anything buffered has to be written out before the process starts writing to the same fds
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.posix_spawnp(argv[0], argv, os.environ, file_actions=list(file_actions))
+    (_, status) = os.waitpid(pid, 0)
+    return os.waitstatus_to_exitcode(status)
+
+
 def bash(cmd: str, quit=False):
     """Executes a bash script as a subprocess."""
     Command("/bin/bash", ["-c", cmd], opts=ExecOpts(quit=quit)).run()
 
 
+def bash_fast(cmd: str, quit=False):
+    """Executes a bash script in a subshell of a shared bash process instead of starting a new
+    one, output is written directly to the terminal without being collected. If the shared
+    process is busy the script is spawned in a new bash."""
+    command = Command("/bin/bash", ["-c", cmd], opts=ExecOpts(quit=quit, redirect=True, follow=False))
+    print(_RUNNING_TPL % command)
+    exit_code = bash_pool.run(cmd)
+    if exit_code is None:
+        command._run_spawn()
+        exit_code = command.exit_code
+
+    if quit and exit_code != 0:
+        sys.exit(exit_code)
+
+
 def ask_user_yn(msg: str, f: Callable, *args: Any, ask=True):
     """Asks user for y/n choice on msg. If the answer is yes calls function f with *args."""
-    outw(Color.BWHITE, msg, f" {Color.GREEN}y(es){Color.NC}/{Color.RED}n(o){Color.NC}/{Color.YELLOW}q(uit){Color.NC}: ")
+    _wv(sys.stdout, Color.BWHITE, msg, _YN_SUFFIX)
     if ask:
-        while True:
+        # raw mode is entered once for the whole prompt instead of on every rejected keystroke
+        with raw_mode():
             ch = getch()
-            if ch == "y":
-                outw(Color.CYAN, ch, "\n", Color.NC)
-                f(*args)
-                break
-            elif ch == "n":
-                outw(Color.CYAN, ch, "\n", Color.NC)
-                break
-            elif ch == "q":
-                outw(Color.CYAN, ch, "\n", Color.NC)
-                raise KeyboardInterrupt
+            while ch not in ("y", "n", "q"):
+                ch = getch()
+
+        _wv(sys.stdout, Color.CYAN, ch, "\n", Color.NC)
+        if ch == "y":
+            f(*args)
+        elif ch == "q":
+            raise KeyboardInterrupt
     else:
-        outw(Color.CYAN, "y\n", Color.NC)
+        _wv(sys.stdout, Color.CYAN, "y\n", Color.NC)
         f(*args)
 
 
-def getch():
-    """Gets a raw character from stdin."""
+@contextmanager
+def raw_mode():
+    """Puts the terminal attached to stdin in raw mode restoring previous settings on exit.
+    Nested contexts don't change terminal settings again."""
+    if getattr(_terminal, "raw", False):
+        yield
+        return
+
     fd = sys.stdin.fileno()
     old_settings = termios.tcgetattr(fd)
     try:
-        tty.setraw(sys.stdin.fileno())
-        ch = sys.stdin.read(1)
+        tty.setraw(fd)
+        _terminal.raw = True
+        yield
     finally:
+        _terminal.raw = False
         termios.tcsetattr(fd, termios.TCSADRAIN, old_settings)
-    return ch
+
+
+def getch():
+    """Gets a raw character from stdin. The byte is read straight from the fd so that the
+    text layer of sys.stdin doesn't buffer keystrokes meant for later prompts."""
+    with raw_mode():
+        return os.read(sys.stdin.fileno(), 1).decode(errors="replace")
+
+
+@contextmanager
+def atomic_open(p: Path, mode: str = "w"):
+    """Opens a temporary file next to p that atomically replaces p once the context exits
+    without errors. If p is a symlink its target is replaced. The temporary file keeps the
+    permissions of the replaced file."""
+    p = Path(os.path.realpath(p))
+    tmp = p.with_name(p.name + ".tmp")
+    try:
+        with open(tmp, mode) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        if p.exists():
+            os.chmod(tmp, stat.S_IMODE(p.stat().st_mode))
+        os.replace(tmp, p)
+    except BaseException:
+        if tmp.exists():
+            os.remove(tmp)
+        raise
+
+
+def _fsync_dir(d: Path):
+    fd = os.open(d, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def fwrite_many(files: Iterable[Tuple[Path, str]]):
+    """Atomically writes each s to a file in path p for all (p, s) pairs. Each parent directory
+    is synced once after all files are written."""
+    dirs = set()
+    for (p, s) in files:
+        _wv(sys.stdout, _WRITING_TPL % (s, p), "\n")
+        with atomic_open(p) as f:
+            f.write(s)
+        dirs.add(Path(os.path.realpath(p)).parent)
+
+    for d in dirs:
+        _fsync_dir(d)
 
 
 def fwrite(p: Path, s: str):
-    """Writes s to a file in path p"""
-    with open(p, "w") as f:
-        print(f"{Color.BWHITE}Writing{Color.NC} `{s}` to {Color.LBLUE}`{str(p)}`{Color.NC}")
-        f.write(s)
+    """Atomically writes s to a file in path p"""
+    fwrite_many([(p, s)])
+
+
+def force_symlink(src: Path, dst: Path):
+    """Creates a symbolic link at dst pointing to src replacing dst if it exists, like `ln -sf`.
+    If dst is a directory the link is created inside of it."""
+    dst = Path(dst)
+    if dst.is_dir() and not dst.is_symlink():
+        dst = dst / Path(src).name
+
+    print(_LINKING_TPL % (src, dst))
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dst.with_name(dst.name + ".tmp")
+    if tmp.is_symlink():
+        os.remove(tmp)
+    os.symlink(src, tmp)
+    os.replace(tmp, dst)
 
 
 def conv_b(_bytes: int) -> str:
@@ -324,39 +632,60 @@ def conv_b(_bytes: int) -> str:
         s = conv_b(1201)
         assert s == "1.20 KB"
     """
-    if _bytes <= KILO:
-        return f"{_bytes:.2f} B"
-    elif KILO < _bytes <= MEGA:
-        return f"{_bytes / KILO:.2f} KB"
-    elif MEGA < _bytes <= GIGA:
-        return f"{_bytes / MEGA:.2f} MB"
-    elif GIGA < _bytes <= TERA:
-        return f"{_bytes / GIGA:.2f} GB"
-    else:
-        return f"{_bytes / TERA:.2f} TB"
+    i = bisect_left(_SIZE_BOUNDS, _bytes)
+    return f"{_bytes / _SIZE_SCALES[i]:.2f} {_SIZE_UNITS[i]}"
 
 
 def measure(func: Callable, *args: Any, **kwargs: Any) -> (Any, float):
     """Measures execution time of func by calling it with *args and **kwargs.
     Returns a tuple consisting of return value of function and execution time as float."""
-    start = time.time()
+    start = time.perf_counter()
     ret = func(*args, **kwargs)
-    end = time.time()
+    end = time.perf_counter()
 
     return (ret, end - start)
 
 
-def run_steps(steps: List[Step], ask=True):
+@contextmanager
+def timed():
+    """Measures execution time of the with block. For example:
+    with timed() as t:
+        work()
+    print(t.elapsed)
+    """
+    timer = Timer()
+    try:
+        yield timer
+    finally:
+        timer.elapsed = time.perf_counter() - timer.start
+
+
+def _step_failed(step: Step):
+    """Prints the exception currently being handled as a failure of step."""
+    s = f"{Color.LBLUE}{step.func.__name__}({' '.join(map(str, step.args))}){Color.NC}"
+    errw(f"{Color.BWHITE}Failed executing step{Color.NC} `{s}` -\n{Color.RED}{traceback.format_exc()}{Color.NC}")
+
+
+def run_steps(steps: List[Step], ask=True, parallel=False):
     """Executes a list of steps asking the user for choice on each step and catching
-    exceptions on each step. If ask is set to False all steps will be executed automatically."""
+    exceptions on each step. If ask is set to False all steps will be executed automatically.
+    Steps that don't depend on each other can be executed concurrently by setting parallel to
+    True, which only applies when ask is False as questions have to be asked one at a time."""
+    if parallel and not ask and len(steps) > 1:
+        with ThreadPoolExecutor(max_workers=min(MAX_STEP_WORKERS, len(steps))) as executor:
+            futures = {executor.submit(step.run, ask=False): step for step in steps}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception:
+                    _step_failed(futures[future])
+        return
+
     for step in steps:
         try:
             step.run(ask=ask)
         except Exception:
-            s = f"{Color.LBLUE}{step.func.__name__}({' '.join(step.args[1:])}){Color.NC}"
-            errw(
-                f"{Color.BWHITE}Failed executing step{Color.NC} `{s}` -\n{Color.RED}{traceback.format_exc()}{Color.NC}"
-            )
+            _step_failed(step)
 
 
 def catch_errs(func: Callable, *args: Any, **kwargs: Any):